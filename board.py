@@ -1,4 +1,7 @@
+import os
+import random
 from collections import namedtuple
+from dataclasses import dataclass
 from enum import Enum
 from typing import TypeAlias, cast, Dict, Optional, Any
 
@@ -16,22 +19,92 @@ class Jump(Enum):
     Backwards = -1
 
 
-Move: type[tuple[Camel, int]] = namedtuple('Move', ['camel', 'steps'])
+@dataclass(slots=True, frozen=True)
+class Move:
+    camel: Camel
+    steps: int
+
+
+@dataclass(slots=True, frozen=True)
+class JumpField:
+    jtype: Jump
+    owner: Any
+
 
-JumpField: type[tuple[Jump, Any]] = namedtuple(
-    'JumpField',
-    ['jtype', 'owner']
-)
 EmptyField: TypeAlias = type[None]
-CamelStack: TypeAlias = list[Camel]
+# Internally camels are referred to by their index into `IDX_CAMEL`, `Camel`
+# values are only used at the edges (moves, rankings, printing).
+CamelStack: TypeAlias = list[int]
 BoardField: TypeAlias = CamelStack | EmptyField | JumpField
-CamelIndex: TypeAlias = Dict[Camel, int]
-Board = namedtuple('Board', ['fields', 'index'])
+CamelIndex: TypeAlias = Dict[int, int]
+
+
+@dataclass(slots=True, frozen=True)
+class Board:
+    fields: list[BoardField]
+    index: CamelIndex
+    # each camel's 0-based height within its stack (or within the stack that
+    # crossed the finish line)
+    heights: CamelIndex
+
+
 BOARD_SIZE = 16
+# run `validate_board` after every move, off with `python -O` or
+# CAMELUP_VALIDATE=0
+VALIDATE_BOARDS = __debug__ and os.environ.get('CAMELUP_VALIDATE', '1') != '0'
+
+# Flat struct-of-arrays view of a board used by the simulation hot path.
+# `pos` and `height` are indexed by camel index, `jump_type` (0 for no jump)
+# and `jump_owner` by board position.
+BoardArrays = namedtuple(
+    'BoardArrays',
+    ['pos', 'height', 'jump_type', 'jump_owner']
+)
+# Everything needed to revert a `move_camel_inplace` call: the moved camels,
+# where they came from, how much their heights changed and which camels were
+# lifted by a stack being dropped underneath them.
+MoveUndo = namedtuple(
+    'MoveUndo',
+    ['move_stack', 'start_pos', 'height_delta', 'lifted']
+)
+IDX_CAMEL: tuple[Camel, ...] = tuple(Camel)
+CAMEL_IDX: Dict[Camel, int] = {
+    camel: i
+    for i, camel in enumerate(IDX_CAMEL)
+}
+# Sets of camels are kept as bitmasks with bit `CAMEL_IDX[camel]` set.
+CamelMask: TypeAlias = int
+ALL_CAMELS: CamelMask = (1 << len(IDX_CAMEL)) - 1
+
+
+def camel_bit(camel: Camel) -> CamelMask:
+    return 1 << CAMEL_IDX[camel]
+
+
+def mask_to_camels(mask: CamelMask) -> list[Camel]:
+    return [camel for i, camel in enumerate(IDX_CAMEL) if mask >> i & 1]
+
+
+# Zobrist keys per (camel, position, height) and per (position, jump type).
+# Camel positions are offset by one for camels not yet on the board (-1), a
+# finished stack can overshoot the last field by up to 2 positions.
+ZOBRIST_POSITIONS = BOARD_SIZE + 4
+_zobrist_rng = random.Random(0)
+ZOBRIST_CAMELS: list[list[list[int]]] = [
+    [
+        [_zobrist_rng.getrandbits(64) for _ in IDX_CAMEL]
+        for _ in range(ZOBRIST_POSITIONS)
+    ]
+    for _ in IDX_CAMEL
+]
+ZOBRIST_JUMPS: list[dict[int, int]] = [
+    {jump.value: _zobrist_rng.getrandbits(64) for jump in Jump}
+    for _ in range(BOARD_SIZE)
+]
 
 
 def create_empty_board() -> Board:
-    return Board([None for _ in range(BOARD_SIZE)], dict())
+    return Board([None for _ in range(BOARD_SIZE)], dict(), dict())
 
 
 def field_to_str(field: BoardField, height: int) -> str:
@@ -40,7 +113,7 @@ def field_to_str(field: BoardField, height: int) -> str:
         return ' '
     if isinstance(field, list):
         if height < len(field):
-            return field[height].value
+            return IDX_CAMEL[field[height]].value
         return ' '
     assert isinstance(field, JumpField)
     if height != 0:
@@ -55,11 +128,17 @@ def validate_board(board: Board):
             continue
         assert isinstance(board.fields[pos], list),\
             f'Board position {pos + 1} is not a camel stack'
-        assert camel in board.fields[pos], f'Camel \'{camel.name}\' not on position {pos + 1}'
+        name = IDX_CAMEL[camel].name
+        assert camel in board.fields[pos], f'Camel \'{name}\' not on position {pos + 1}'
+        assert board.fields[pos].index(camel) == board.heights[camel],\
+            f'Camel \'{name}\' not at height {board.heights[camel]}'
 
 
-def validates_board(ret_pos: Optional[int]):
+def validates_board(ret_pos: Optional[int], enabled: bool = VALIDATE_BOARDS):
     def decorator(f):
+        if not enabled:
+            return f
+
         def wrapped_f(*args, **kwargs):
             res = f(*args, **kwargs)
             if ret_pos is None:
@@ -73,11 +152,43 @@ def validates_board(ret_pos: Optional[int]):
 
 
 def copy_board(board: Board) -> Board:
-    fields = [
-        field.copy() if isinstance(field, list) else field
-        for field in board.fields
-    ]
-    return Board(fields, board.index.copy())
+    # camel stacks are never mutated in place, only replaced, so they can be
+    # shared between copies
+    return Board(
+        board.fields.copy(),
+        board.index.copy(),
+        board.heights.copy()
+    )
+
+
+def board_to_arrays(board: Board) -> BoardArrays:
+    pos = [-1 for _ in IDX_CAMEL]
+    height = [0 for _ in IDX_CAMEL]
+    jump_type = [0 for _ in range(BOARD_SIZE)]
+    jump_owner: list[Any] = [None for _ in range(BOARD_SIZE)]
+    for i, field in enumerate(board.fields):
+        if isinstance(field, JumpField):
+            jump_type[i] = field.jtype.value
+            jump_owner[i] = field.owner
+    for camel, index in board.index.items():
+        pos[camel] = index
+        height[camel] = board.heights[camel]
+    return BoardArrays(pos, height, jump_type, jump_owner)
+
+
+def zobrist_camels(pos: list[int], height: list[int]) -> int:
+    key = 0
+    for camel in range(len(pos)):
+        key ^= ZOBRIST_CAMELS[camel][pos[camel] + 1][height[camel]]
+    return key
+
+
+def zobrist_jumps(jump_type: list[int]) -> int:
+    key = 0
+    for i, jtype in enumerate(jump_type):
+        if jtype:
+            key ^= ZOBRIST_JUMPS[i][jtype]
+    return key
 
 
 def print_board(board: Board) -> None:
@@ -92,62 +203,124 @@ def print_board(board: Board) -> None:
     validate_board(board)
 
 
-def get_rankings(board: Board, winners: Optional[list[Camel]]) -> list[Camel]:
-    unsorted_camels = [
-        (camel, (index, (board.fields[index] if index <
-         BOARD_SIZE else winners).index(camel)))
-        for camel, index in board.index.items()
-    ]
-    indexed_camels = sorted(unsorted_camels, key=lambda v: v[1], reverse=True)
-    return [indexed_camel[0] for indexed_camel in indexed_camels]
+def get_rankings(board: Board) -> list[Camel]:
+    # (index, height, camel) rows are unique per camel so they can be compared
+    # directly, without a Python key function
+    ranked = sorted(
+        (
+            (index, board.heights[camel], camel)
+            for camel, index in board.index.items()
+        ),
+        reverse=True
+    )
+    return [IDX_CAMEL[camel] for _, _, camel in ranked]
+
+
+def rank_camels(pos: list[int], height: list[int]) -> list[int]:
+    # same key-less sort as `get_rankings` on the flat arrays
+    ranked = sorted(zip(pos, height, range(len(pos))), reverse=True)
+    return [camel for _, _, camel in ranked]
+
+
+def move_camel_inplace(
+    pos: list[int],
+    height: list[int],
+    jump_type: list[int],
+    camel: int,
+    steps: int
+) -> tuple[int, bool, MoveUndo]:
+    '''
+    Moves the camel with index `camel` by mutating `pos` and `height`,
+    placing it like `apply_move` if it is not on the board yet (-1).
+    Returns the position of the jump that was hit (-1 if none), whether the
+    moved stack crossed the finish line and a token for `undo_camel_move`.
+    '''
+    start_pos = pos[camel]
+    start_height = height[camel]
+    jump_pos = -1
+    shift = 0
+    if start_pos < 0:
+        move_stack = [camel]
+        end_pos = steps - 1
+    else:
+        move_stack = [
+            c
+            for c in range(len(pos))
+            if pos[c] == start_pos and height[c] >= start_height
+        ]
+        end_pos = start_pos + steps
+    if start_pos >= 0 and end_pos < BOARD_SIZE and jump_type[end_pos]:
+        jump_pos = end_pos
+        shift = jump_type[end_pos]
+        end_pos += shift
+    base = 0
+    lifted = []
+    if end_pos < BOARD_SIZE:
+        for c in range(len(pos)):
+            if pos[c] != end_pos or c in move_stack:
+                continue
+            if shift == -1:
+                height[c] += len(move_stack)
+                lifted.append(c)
+            else:
+                base += 1
+    height_delta = base - start_height
+    for c in move_stack:
+        pos[c] = end_pos
+        height[c] += height_delta
+    undo = MoveUndo(move_stack, start_pos, height_delta, lifted)
+    return jump_pos, end_pos >= BOARD_SIZE, undo
+
+
+def undo_camel_move(pos: list[int], height: list[int], undo: MoveUndo) -> None:
+    for c in undo.lifted:
+        height[c] -= len(undo.move_stack)
+    for c in undo.move_stack:
+        pos[c] = undo.start_pos
+        height[c] -= undo.height_delta
 
 
 @validates_board(0)
 def apply_move(board: Board, move: Move) -> tuple[Board, Optional[Any], Optional[list[Camel]]]:
     board = copy_board(board)
 
-    if move.camel not in board.index:
+    def place_stack(stack: CamelStack, pos: int, start: int = 0):
+        for height, c in enumerate(stack[start:], start=start):
+            board.index[c] = pos
+            board.heights[c] = height
+
+    # stacks are replaced rather than mutated as `copy_board` shares them
+    camel = CAMEL_IDX[move.camel]
+    if camel not in board.index:
         pos = move.steps - 1
-        board.index[move.camel] = pos
         field = board.fields[pos]
         assert not isinstance(field, JumpField), 'Jump at start'
-        if isinstance(field, list):
-            field.append(move.camel)
-        else:
-            board.fields[pos] = [move.camel]
+        board.fields[pos] = (field or []) + [camel]
+        place_stack(board.fields[pos], pos, len(board.fields[pos]) - 1)
         return board, None, None
 
-    start_pos = board.index[move.camel]
-    height = board.fields[start_pos].index(move.camel)
+    start_pos = board.index[camel]
+    height = board.heights[camel]
     move_stack = board.fields[start_pos][height:]
-    sliced_stack = board.fields[start_pos][:height]
-    board.fields[start_pos] = sliced_stack or None
-    for camel in move_stack:
-        board.index[camel] += move.steps
+    board.fields[start_pos] = board.fields[start_pos][:height] or None
     end_pos = start_pos + move.steps
-    if end_pos >= BOARD_SIZE:
-        return board, None, move_stack
-    dest_field = board.fields[end_pos]
     owner = None
-    if isinstance(dest_field, JumpField):
-        owner = dest_field.owner
-        shift = dest_field.jtype.value
+    shift = 0
+    if end_pos < BOARD_SIZE and isinstance(board.fields[end_pos], JumpField):
+        owner = board.fields[end_pos].owner
+        shift = board.fields[end_pos].jtype.value
         end_pos += shift
-        for camel in move_stack:
-            board.index[camel] += shift
-        if end_pos >= BOARD_SIZE:
-            return board, owner, move_stack
-        if shift == -1:
-            if board.fields[end_pos] is None:
-                board.fields[end_pos] = move_stack
-            else:
-                board.fields[end_pos] = move_stack + board.fields[end_pos]
-            return board, owner, None
+    if end_pos >= BOARD_SIZE:
+        place_stack(move_stack, end_pos)
+        return board, owner, [IDX_CAMEL[c] for c in move_stack]
 
-    if board.fields[end_pos] is None:
-        board.fields[end_pos] = move_stack
+    dest_stack = board.fields[end_pos] or []
+    if shift == -1:
+        board.fields[end_pos] = move_stack + dest_stack
+        place_stack(board.fields[end_pos], end_pos)
     else:
-        board.fields[end_pos] += move_stack
+        board.fields[end_pos] = dest_stack + move_stack
+        place_stack(board.fields[end_pos], end_pos, len(dest_stack))
     return board, owner, None
 
 
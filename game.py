@@ -1,8 +1,9 @@
 from typing import Dict, Any, TypeAlias, Optional
-from collections import namedtuple
+from dataclasses import dataclass
 from enum import Enum
 from board import (Camel, Board, Move, Jump, copy_board, create_empty_board,
-                   print_board, apply_move, JumpField, get_rankings)
+                   print_board, apply_move, JumpField, get_rankings, ALL_CAMELS,
+                   CamelMask, camel_bit, mask_to_camels, CAMEL_IDX, IDX_CAMEL)
 
 
 class BetSize(Enum):
@@ -12,14 +13,66 @@ class BetSize(Enum):
 
 
 Bets: TypeAlias = Dict[Camel, list[BetSize]]
-Bet = namedtuple('Bet', ['size', 'camel'])
-Player = namedtuple('Player', ['balance', 'owned_bets'])
+
+
+@dataclass(slots=True, frozen=True)
+class Bet:
+    size: BetSize
+    camel: Camel
+
+
+BET_SIZES: tuple[BetSize, ...] = tuple(BetSize)
+BET_SIZE_IDX: Dict[BetSize, int] = {
+    size: i
+    for i, size in enumerate(BET_SIZES)
+}
+# Sets of bets are kept as bitmasks with bit
+# `CAMEL_IDX[camel] * len(BET_SIZES) + BET_SIZE_IDX[size]` set.
+BetMask: TypeAlias = int
+
+
+def bet_bit(bet: Bet) -> BetMask:
+    return 1 << (CAMEL_IDX[bet.camel] * len(BET_SIZES) + BET_SIZE_IDX[bet.size])
+
+
+def mask_to_bets(mask: BetMask) -> list[Bet]:
+    bets = []
+    while mask:
+        bit = mask & -mask
+        mask ^= bit
+        camel, size = divmod(bit.bit_length() - 1, len(BET_SIZES))
+        bets.append(Bet(BET_SIZES[size], IDX_CAMEL[camel]))
+    return bets
+
+
+@dataclass(slots=True, frozen=True)
+class Player:
+    balance: int
+    owned_bets: BetMask
+
+
 Players: TypeAlias = dict[Any, Player]
-Game = namedtuple('Game', ['board', 'players', 'bets', 'camels_left'])
+
+
+@dataclass(slots=True, frozen=True)
+class Game:
+    board: Board
+    players: Players
+    bets: Bets
+    camels_left: CamelMask
+
 
 # action = [Roll (Move), Place, Bet (Camel)]
-Place: type[tuple[int, Jump]] = namedtuple('Place', ['position', 'jump'])
-OwnedAction = namedtuple('OwnedAction', ['owner', 'action'])
+@dataclass(slots=True, frozen=True)
+class Place:
+    position: int
+    jump: Jump
+
+
+@dataclass(slots=True, frozen=True)
+class OwnedAction:
+    owner: Any
+    action: Move | Place | Camel
 
 
 def reset_bets() -> Bets:
@@ -29,18 +82,9 @@ def reset_bets() -> Bets:
     }
 
 
-def copy_player(player: Player) -> Player:
-    return Player(
-        player.balance,
-        player.owned_bets.copy()
-    )
-
-
 def copy_players(players: Players) -> Players:
-    return {
-        name: copy_player(player)
-        for name, player in players.items()
-    }
+    # players are immutable, only the mapping needs copying
+    return players.copy()
 
 
 def copy_bets(bets: Bets) -> Bets:
@@ -55,7 +99,7 @@ def copy_game(game: Game) -> Game:
         copy_board(game.board),
         copy_players(game.players),
         copy_bets(game.bets),
-        game.camels_left.copy()
+        game.camels_left
     )
 
 
@@ -63,11 +107,11 @@ def init_game(*players) -> Game:
     return Game(
         create_empty_board(),
         {
-            name: Player(3, set())
+            name: Player(3, 0)
             for name in players
         },
         reset_bets(),
-        set(Camel)
+        ALL_CAMELS
     )
 
 
@@ -81,8 +125,8 @@ def players_to_strings(players: Players):
     for name, player in sorted(players.items(), key=lambda p: (p[1].balance, p[0])):
         if player.owned_bets:
             owned_bets = ' '.join([
-                f'{camel.value}{bet.value}'
-                for bet, camel in player.owned_bets
+                f'{bet.camel.value}{bet.size.value}'
+                for bet in mask_to_bets(player.owned_bets)
             ])
             yield f'{name}[{player.balance} ({owned_bets})]'
         else:
@@ -102,7 +146,7 @@ def print_game(game: Game):
     print('Bets:', bets)
     camels = ', '.join(
         camel.name
-        for camel in sorted(game.camels_left, key=lambda c: c.name)
+        for camel in sorted(mask_to_camels(game.camels_left), key=lambda c: c.name)
     )
     print('Camels:', camels)
     print('Board:')
@@ -117,14 +161,14 @@ def change_balance(players: Players, name, delta):
 
 
 def evaluate_bets(game: Game, board: Board) -> Game:
-    fst, snd, *_ = get_rankings(board, None)
+    fst, snd, *_ = get_rankings(board)
 
     for name, player in game.players.items():
         net_win = 0
-        for bet_size, camel in player.owned_bets:
-            if fst == camel:
-                net_win += bet_size.value
-            elif snd == camel:
+        for bet in mask_to_bets(player.owned_bets):
+            if fst == bet.camel:
+                net_win += bet.size.value
+            elif snd == bet.camel:
                 net_win += 1
             else:
                 net_win -= 1
@@ -135,11 +179,11 @@ def evaluate_bets(game: Game, board: Board) -> Game:
     return Game(
         board,
         {
-            name: Player(balance, set())
-            for name, (balance, _) in game.players.items()
+            name: Player(player.balance, 0)
+            for name, player in game.players.items()
         },
         reset_bets(),
-        set(Camel)
+        ALL_CAMELS
     )
 
 
@@ -148,14 +192,14 @@ def apply_action(game: Game, action: OwnedAction) -> tuple[Game, Optional[Any]]:
     owner = action.owner
     action = action.action
     if isinstance(action, Move):
-        if not (owner is None and action.camel in game.camels_left):
+        if not (owner is None and game.camels_left & camel_bit(action.camel)):
             # award make move stipend
             change_balance(game.players, owner, 1)
 
         board, shifter, winner = apply_move(game.board, action)
         if shifter is not None:
             change_balance(game.players, shifter, 1)
-        camels_left = game.camels_left - {action.camel}
+        camels_left = game.camels_left & ~camel_bit(action.camel)
         if camels_left:
             return Game(
                 board,
@@ -170,8 +214,11 @@ def apply_action(game: Game, action: OwnedAction) -> tuple[Game, Optional[Any]]:
     else:
         assert isinstance(action, Camel),\
             f'Action must be Move, Bet(Camel) or Place instead got {action}'
-        game.players[owner].owned_bets.add(
-            Bet(game.bets[action].pop(), action)
+        player = game.players[owner]
+        bet = Bet(game.bets[action].pop(), action)
+        game.players[owner] = Player(
+            player.balance,
+            player.owned_bets | bet_bit(bet)
         )
     return game, None
 
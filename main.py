@@ -1,13 +1,19 @@
 import re
 import sys
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from operator import add, mul
 from enum import Enum
-from board import apply_move, Move, Camel, Jump, JumpField, copy_board, get_rankings
-from game import OwnedAction, apply_action, Place, print_game, init_game, Game
-from itertools import product, permutations, starmap
+from board import (Move, Camel, Jump, JumpField, get_rankings, board_to_arrays,
+                   move_camel_inplace, undo_camel_move, rank_camels,
+                   zobrist_camels, zobrist_jumps, IDX_CAMEL, CAMEL_IDX, camel_bit)
+from game import (OwnedAction, apply_action, Place, print_game, init_game, Game,
+                  Bet, BetSize, mask_to_bets)
 from typing import Optional
 
 
+PLACE_PATTERN = re.compile(r'(?:([+-])(\d{1,2})|(\d{1,2})([+-]))')
+
+
 class ParseError(Exception):
     pass
 
@@ -43,13 +49,13 @@ def parse_move(game: Game, inp: str) -> Move:
     if not raw_steps.isdigit() or (steps := int(raw_steps)) not in (1, 2, 3):
         raise ParseError(f'Invalid steps {raw_steps!r}')
     camel = parse_camel(camel_char)
-    if camel not in game.camels_left:
+    if not game.camels_left & camel_bit(camel):
         raise ParseError(f'{camel.name} already moved')
     return Move(camel, steps)
 
 
 def parse_place(game: Game, inp: str) -> Place:
-    if not (m := re.match(r'(?:([+-])(\d{1,2})|(\d{1,2})([+-]))', inp)):
+    if not (m := PLACE_PATTERN.match(inp)):
         raise ParseError(
             f'Place input {inp!r} does not match +XX, -XX, XX-, XX+'
         )
@@ -77,54 +83,195 @@ def parse_bet(game: Game, camel_char: str):
     return camel
 
 
-def simulate_probs(game: Game):
+# Maximum number of explored subtrees remembered during one simulation.
+TRANSPOSITION_CAPACITY = 1 << 16
+# Maximum number of simulation results remembered across calls, repeated
+# `sim` commands on an unchanged game are answered from here.
+SIM_CACHE_CAPACITY = 32
+_sim_cache = OrderedDict()
+
+
+def _count_paths(camels: int) -> int:
+    # number of distinct camel order / dice roll sequences for the leg
+    paths = 1
+    for i in range(1, camels + 1):
+        paths *= 3 * i
+    return paths
+
+
+# Tables indexed by a bitmask of camels that still have to move: how many
+# paths are left and which (camel, remaining mask after its move) choices
+# there are. Built once at import instead of on every simulation.
+_MASKS = range(1 << len(IDX_CAMEL))
+_MASK_PATHS = [_count_paths(bin(mask).count('1')) for mask in _MASKS]
+_MASK_MOVES = [
+    tuple(
+        (camel, mask & ~(1 << camel))
+        for camel in range(len(IDX_CAMEL))
+        if mask >> camel & 1
+    )
+    for mask in _MASKS
+]
+
+
+def _bet_payoff(camel: Camel, size: BetSize) -> list[int]:
+    # payoff of the bet for every leg outcome, outcome `first * n + second`
+    # being the camel indices finishing first and second
+    target = CAMEL_IDX[camel]
+    return [
+        size.value if fst == target else 1 if snd == target else -1
+        for fst in range(len(IDX_CAMEL))
+        for snd in range(len(IDX_CAMEL))
+    ]
+
+
+_BET_PAYOFFS = {
+    (camel, size): _bet_payoff(camel, size)
+    for camel in Camel
+    for size in BetSize
+}
+
+
+def _simulate_kernel(pos, height, jump_type, camels_left):
+    '''Pair, win, loss and jump hit frequencies over every path of the leg.'''
+    n = len(pos)
+    pairs_size = n * n
+    # flat accumulator of path counts: (first, second) pairs, wins and losses
+    # per camel followed by the jump hits per board position, each leaf
+    # counting for every path of the flat enumeration that shares its prefix
+    acc = [0 for _ in range(pairs_size + 2 * n + len(jump_type))]
+    total_paths = _MASK_PATHS[camels_left]
+    # subtree results keyed by board (jumps cannot change during the leg)
+    # and remaining camels, different move orders can reach the same state
+    transpositions = OrderedDict()
+
+    def play(camel, steps, rest_mask, acc):
+        jump_pos, finished, undo = move_camel_inplace(
+            pos,
+            height,
+            jump_type,
+            camel,
+            steps
+        )
+        weight = _MASK_PATHS[rest_mask]
+        if jump_pos >= 0:
+            acc[pairs_size + 2 * n + jump_pos] += weight
+        if rest_mask and not finished:
+            explore(rest_mask, acc)
+        else:
+            fst, snd, *_, lst = rank_camels(pos, height)
+            if finished:
+                acc[pairs_size + fst] += weight
+                acc[pairs_size + n + lst] += weight
+            acc[fst * n + snd] += weight
+        undo_camel_move(pos, height, undo)
+
+    def explore(mask, acc):
+        key = (zobrist_camels(pos, height), mask)
+        sub = transpositions.get(key)
+        if sub is None:
+            sub = [0 for _ in acc]
+            for camel, rest_mask in _MASK_MOVES[mask]:
+                for steps in range(1, 4):
+                    play(camel, steps, rest_mask, sub)
+            transpositions[key] = sub
+            if len(transpositions) > TRANSPOSITION_CAPACITY:
+                transpositions.popitem(last=False)
+        else:
+            transpositions.move_to_end(key)
+        acc[:] = map(add, acc, sub)
+
+    explore(camels_left, acc)
+    # the only division, frequencies are fractions of all paths of the leg
+    probs = [count / total_paths for count in acc]
+    return (
+        probs[:pairs_size],
+        probs[pairs_size:pairs_size + n],
+        probs[pairs_size + n:pairs_size + 2 * n],
+        probs[pairs_size + 2 * n:]
+    )
+
+
+def _simulate(game: Game):
+    board = board_to_arrays(game.board)
+    key = (
+        zobrist_camels(board.pos, board.height) ^ zobrist_jumps(board.jump_type),
+        game.camels_left,
+        tuple(board.jump_owner)
+    )
+    if (cached := _sim_cache.get(key)) is not None:
+        _sim_cache.move_to_end(key)
+        return cached
+    _sim_cache[key] = board, _simulate_kernel(
+        board.pos,
+        board.height,
+        board.jump_type,
+        game.camels_left
+    )
+    if len(_sim_cache) > SIM_CACHE_CAPACITY:
+        _sim_cache.popitem(last=False)
+    return _sim_cache[key]
+
+
+def _place_probs(pairs):
     fst_p = defaultdict(float)
     snd_p = defaultdict(float)
+    for i, p in enumerate(pairs):
+        if p:
+            fst, snd = divmod(i, len(IDX_CAMEL))
+            fst_p[IDX_CAMEL[fst]] += p
+            snd_p[IDX_CAMEL[snd]] += p
+    return fst_p, snd_p
+
+
+def simulate_probs(game: Game):
+    '''
+    First and second place, race win and race loss probabilities per camel and
+    jump hit probabilities per jump owner over the rest of the leg.
+    '''
     winners = defaultdict(float)
     losers = defaultdict(float)
     shifts = defaultdict(float)
-    total_paths = 1
-    for i in range(1, len(game.camels_left) + 1):
-        total_paths *= 3 * i
-    for camel_order in permutations(game.camels_left):
-        for move_steps in product(*[range(1, 4) for _ in range(len(game.camels_left))]):
-            sub_board = copy_board(game.board)
-            for move in starmap(Move, zip(camel_order, move_steps)):
-                sub_board, shifter, winner_stack = apply_move(sub_board, move)
-                if shifter is not None:
-                    shifts[shifter] += 1/total_paths
-                if winner_stack is not None:
-                    break
-            fst_camel, snd_camel, _, _, lst_camel = get_rankings(
-                sub_board,
-                winner_stack
-            )
-            if winner_stack is not None:
-                winners[fst_camel] += 1 / total_paths
-                losers[lst_camel] += 1 / total_paths
-            fst_p[fst_camel] += 1 / total_paths
-            snd_p[snd_camel] += 1 / total_paths
+    board, (pairs, winner_row, loser_row, shift_row) = _simulate(game)
+    fst_p, snd_p = _place_probs(pairs)
+    for probs, row in zip((winners, losers), (winner_row, loser_row)):
+        for i, p in enumerate(row):
+            if p:
+                probs[IDX_CAMEL[i]] += p
+    for i, p in enumerate(shift_row):
+        if p:
+            shifts[board.jump_owner[i]] += p
     return fst_p, snd_p, winners, losers, shifts
 
 
+def simulate_evs(game: Game):
+    '''Place probabilities, best available bet EV per camel and player EVs.'''
+    _, (pairs, *_) = _simulate(game)
+
+    def ev(bet: Bet) -> float:
+        return sum(map(mul, _BET_PAYOFFS[bet.camel, bet.size], pairs))
+
+    bet_evs = {
+        camel: ev(Bet(bets[-1], camel))
+        for camel, bets in game.bets.items()
+        if bets
+    }
+    player_evs = {
+        name: sum(ev(bet) for bet in mask_to_bets(player.owned_bets))
+        for name, player in game.players.items()
+    }
+    return *_place_probs(pairs), bet_evs, player_evs
+
+
 def show_evs(game: Game):
-    fst_p, snd_p, *_ = simulate_probs(game)
+    fst_p, snd_p, bet_evs, player_evs = simulate_evs(game)
     for camel in sorted(Camel, key=lambda c: fst_p[c], reverse=True):
-        cfst_p = fst_p[camel]
-        csnd_p = snd_p[camel]
-        if game.bets[camel]:
-            lose_p = 1 - (cfst_p + csnd_p)
-            ev = game.bets[camel][-1].value * cfst_p + 1 * csnd_p - 1 * lose_p
-            ev_as_str = f'{ev:5.2f}'
+        if camel in bet_evs:
+            ev_as_str = f'{bet_evs[camel]:5.2f}'
         else:
             ev_as_str = 'None'
-        print(f'{camel.name:6} ({cfst_p:5.1%} | {csnd_p:5.1%}): {ev_as_str}')
-    for name, player in game.players.items():
-        total_ev = sum(
-            bet_size.value * fst_p[camel] + 1 * snd_p[camel] -
-            1 * (1 - fst_p[camel] - snd_p[camel])
-            for bet_size, camel in player.owned_bets
-        )
+        print(f'{camel.name:6} ({fst_p[camel]:5.1%} | {snd_p[camel]:5.1%}): {ev_as_str}')
+    for name, total_ev in player_evs.items():
         print(f'{name}: {total_ev:5.2f}')
 
 
@@ -136,7 +283,7 @@ def parse_action(game: Game, inp: str) -> Optional[OwnedAction | CmdAction]:
         )
     cmd, *args = split_res
 
-    if set(game.board.index) == set(Camel):
+    if len(game.board.index) == len(IDX_CAMEL):
         if cmd in ('move', 'place', 'bet'):
             owner, *args = args
             if owner not in game.players:
@@ -166,7 +313,7 @@ def parse_action(game: Game, inp: str) -> Optional[OwnedAction | CmdAction]:
         print_game(game)
         print()
     elif cmd == 'rank':
-        ranked = get_rankings(game.board, None)
+        ranked = get_rankings(game.board)
         for i, camel in enumerate(ranked, start=1):
             print(f'#{i} {camel.name}')
     elif cmd == 'undo':
@@ -179,7 +326,7 @@ def parse_action(game: Game, inp: str) -> Optional[OwnedAction | CmdAction]:
         return CmdAction.Reset
     elif cmd == 'clear':
         print('\n'*50)
-    elif set(game.board.index) != set(Camel):
+    elif len(game.board.index) != len(IDX_CAMEL):
         move = parse_move(game, inp)
         return OwnedAction(None, move)
     else: